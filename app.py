@@ -1,15 +1,27 @@
+import hashlib
+
 import streamlit as st
 from chatbot_engine import ask_bot, extract_text
 
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def cached_extract_text(digest: bytes, max_pages: int, _uploaded) -> str:
+    # Streamlit re-runs the script on every interaction; key on the content
+    # hash (the leading underscore keeps _uploaded out of Streamlit's own hashing).
+    return extract_text(_uploaded, max_pages=max_pages)
+
+
 st.set_page_config(page_title="MISRA C Chatbot", layout="wide")
 st.title("Embedded C Chatbot (MISRA + SESD 276)")
 
 uploaded = st.file_uploader("Upload Hardware Datasheet (PDF)", type=["pdf"])
+max_pages = st.slider("Datasheet pages to read", min_value=1, max_value=500, value=40)
 query = st.text_input("Ask for code:")
 
 if st.button("Generate Code"):
     if uploaded and query:
-        text = extract_text(uploaded)
+        digest = hashlib.blake2b(uploaded.getbuffer(), digest_size=16).digest()
+        text = cached_extract_text(digest, max_pages, uploaded)
         result = ask_bot(query, text)
         st.code(result, language="c")
     elif query:
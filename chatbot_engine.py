@@ -2,18 +2,53 @@
 # Robust text extraction + simple MISRA-aware generator with LED blink support.
 # Works with Streamlit file uploader (file-like) or local PDF path.
 import io
+import logging
+import os
 import sys
-
-# Try optional backends
-try:
-    import pdfplumber
-except Exception:
-    pdfplumber = None
-
+import threading
+import types
+
+# Diagnostics go through logging (default WARNING, so per-page debug output
+# costs nothing); set MISRA_LOG_LEVEL=DEBUG to see it on stderr
+logger = logging.getLogger(__name__)
+_LOG_LEVEL = os.environ.get("MISRA_LOG_LEVEL")
+if _LOG_LEVEL:
+    logger.addHandler(logging.StreamHandler(sys.stderr))
 try:
-    import fitz  # PyMuPDF
-except Exception:
-    fitz = None
+    logger.setLevel((_LOG_LEVEL or "WARNING").upper())
+except ValueError:
+    logger.setLevel(logging.WARNING)
+    logger.warning("MISRA_LOG_LEVEL=%r is not a log level; using WARNING", _LOG_LEVEL)
+
+# pdfminer (under pdfplumber) logs per token at DEBUG; keep it quiet even if
+# the host app lowers the root log level
+logging.getLogger("pdfminer").setLevel(logging.WARNING)
+logging.getLogger("pdfminer.pdfinterp").setLevel(logging.WARNING)
+
+# Optional backends, imported on first use so cold start doesn't pay for them
+_SENTINEL = object()
+pdfplumber = _SENTINEL
+fitz = _SENTINEL
+
+def _get_pdfplumber():
+    global pdfplumber
+    if pdfplumber is _SENTINEL:
+        try:
+            import pdfplumber as _p
+        except Exception:
+            _p = None
+        pdfplumber = _p
+    return pdfplumber
+
+def _get_fitz():
+    global fitz
+    if fitz is _SENTINEL:
+        try:
+            import fitz as _f  # PyMuPDF
+        except Exception:
+            _f = None
+        fitz = _f
+    return fitz
 
 MISRA_RULES = [
     "No dynamic memory allocation (malloc, free, calloc, realloc forbidden).",
@@ -28,108 +63,170 @@ MISRA_RULES = [
     "Avoid non-deterministic behavior: no undefined or unspecified constructs."
 ]
 
-def extract_text(uploaded_file) -> str:
-    """
-    Accepts a Streamlit UploadedFile (file-like) or a filesystem path (str/Path).
-    Returns extracted text. Always returns a string (possibly empty).
-    Uses pdfplumber first, falls back to PyMuPDF (fitz). Catches errors and prints debug info.
-    """
-    text_parts = []
+# A PDF "source" is either a filesystem path (str) or a bytes-like buffer
+# (bytes / memoryview). Paths go straight to the backend so nothing is
+# read into Python first.
+def _is_path(src) -> bool:
+    return isinstance(src, str)
 
-    # Helper: use pdfplumber from bytes buffer
-    def _pdfplumber_from_bytes(b: bytes):
-        nonlocal text_parts
-        try:
-            if pdfplumber is None:
-                print("pdfplumber not installed; skipping pdfplumber extraction", file=sys.stderr)
-                return False
-            with pdfplumber.open(io.BytesIO(b)) as pdf:
-                for i, page in enumerate(pdf.pages):
-                    try:
-                        ptext = page.extract_text()
-                        if ptext:
-                            text_parts.append(ptext)
-                    except Exception as e:
-                        print(f"pdfplumber: page {i} extraction error: {e}", file=sys.stderr)
-            return True
-        except Exception as e:
-            print(f"pdfplumber open failed: {e}", file=sys.stderr)
-            return False
+# Pages are newline-separated, same as "\n".join over the page texts
+def _write_page(buf: io.StringIO, ptext: str) -> None:
+    if buf.tell():
+        buf.write("\n")
+    buf.write(ptext)
 
-    # Helper: use PyMuPDF (fitz) from bytes
-    def _fitz_from_bytes(b: bytes):
-        nonlocal text_parts
-        try:
-            if fitz is None:
-                print("PyMuPDF (fitz) not installed; skipping fitz extraction", file=sys.stderr)
-                return False
-            doc = fitz.open(stream=b, filetype="pdf")
-            for i, page in enumerate(doc):
+# Helper: use pdfplumber from a path or buffer
+def _pdfplumber_extract(src, buf: io.StringIO, max_pages: int) -> bool:
+    try:
+        pdfplumber = _get_pdfplumber()
+        if pdfplumber is None:
+            logger.warning("pdfplumber not installed; skipping pdfplumber extraction")
+            return False
+        pages = list(range(1, max_pages + 1))
+        with pdfplumber.open(src if _is_path(src) else io.BytesIO(src), pages=pages) as pdf:
+            for i, page in enumerate(pdf.pages):
                 try:
-                    ptext = page.get_text("text")
+                    ptext = page.extract_text()
                     if ptext:
-                        text_parts.append(ptext)
+                        _write_page(buf, ptext)
                 except Exception as e:
-                    print(f"fitz: page {i} extraction error: {e}", file=sys.stderr)
-            doc.close()
-            return True
-        except Exception as e:
-            print(f"fitz open failed: {e}", file=sys.stderr)
+                    logger.debug("pdfplumber: page %d extraction error: %s", i, e)
+        return True
+    except Exception as e:
+        logger.warning("pdfplumber open failed: %s", e)
+        return False
+
+# Pages whose content stream exceeds this many bytes but carry under
+# _GRAPHICS_PAGE_MIN_CHARS of text are treated as figures and skipped
+_GRAPHICS_PAGE_BYTES = 1000000
+try:
+    _GRAPHICS_PAGE_BYTES = int(os.environ.get("MISRA_GRAPHICS_PAGE_BYTES", _GRAPHICS_PAGE_BYTES))
+except ValueError:
+    logger.warning(
+        "MISRA_GRAPHICS_PAGE_BYTES=%r is not an integer; using %d",
+        os.environ["MISRA_GRAPHICS_PAGE_BYTES"], _GRAPHICS_PAGE_BYTES,
+    )
+_GRAPHICS_PAGE_MIN_CHARS = 200
+
+def _is_graphics_page(page) -> bool:
+    if len(page.read_contents()) <= _GRAPHICS_PAGE_BYTES:
+        return False
+    chars = sum(len(blk[4]) for blk in page.get_text("blocks"))
+    return chars < _GRAPHICS_PAGE_MIN_CHARS
+
+def _fitz_open(src):
+    fitz = _get_fitz()
+    if _is_path(src):
+        return fitz.open(src)
+    try:
+        return fitz.open(stream=src, filetype="pdf")
+    except TypeError:
+        # PyMuPDF before memoryview support (e.g. 1.23) only takes bytes,
+        # bytearray or BytesIO as a stream; copy the view for those
+        if isinstance(src, memoryview):
+            return fitz.open(stream=bytes(src), filetype="pdf")
+        raise
+
+# Helper: use PyMuPDF (fitz) from a path or buffer. Pages are read serially
+# from one Document: PyMuPDF holds the GIL and does not support threads.
+def _fitz_extract(src, buf: io.StringIO, max_pages: int) -> bool:
+    try:
+        fitz = _get_fitz()
+        if fitz is None:
+            logger.warning("PyMuPDF (fitz) not installed; skipping fitz extraction")
             return False
+        # Raw text only: no ligature/image handling, and skip text outside the
+        # page box. TEXT_INHIBIT_SPACES is left off since it would glue table
+        # cells ("CR1 0x00") together.
+        textflags = fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
+        with _fitz_open(src) as doc:
+            for i in range(min(doc.page_count, max_pages)):
+                try:
+                    page = doc[i]
+                    if _is_graphics_page(page):
+                        continue
+                    ptext = page.get_text("text", flags=textflags, sort=False)
+                    if ptext:
+                        _write_page(buf, ptext)
+                except Exception as e:
+                    logger.debug("fitz: page %d extraction error: %s", i, e)
+        return True
+    except Exception as e:
+        logger.warning("fitz open failed: %s", e)
+        return False
 
-    # Handle streamlit UploadedFile (has .read) or a file path string
+# Empty or non-PDF input is rejected up front instead of letting both
+# backends fail on it. The spec allows junk before the header, so look
+# anywhere in the first 1 KiB like the readers do.
+def _has_pdf_header(src) -> bool:
     try:
-        if hasattr(uploaded_file, "read"):
-            b = uploaded_file.read()
-            # reset pointer for Streamlit (optional)
-            try:
-                uploaded_file.seek(0)
-            except Exception:
-                pass
-            used = _pdfplumber_from_bytes(b)
-            if not used:
-                _fitz_from_bytes(b)
+        if _is_path(src):
+            with open(src, "rb") as fh:
+                head = fh.read(1024)
         else:
-            # treat as path string
-            path = str(uploaded_file)
-            try:
-                with open(path, "rb") as fh:
-                    b = fh.read()
-                used = _pdfplumber_from_bytes(b)
-                if not used:
-                    _fitz_from_bytes(b)
-            except Exception as e:
-                print(f"Failed to open path {path}: {e}", file=sys.stderr)
+            head = bytes(src[:1024])
+    except Exception as e:
+        logger.warning("Failed to open path %s: %s", src, e)
+        return False
+    return b"%PDF-" in head
+
+def _extract_source(src, max_pages: int) -> str:
+    if not _has_pdf_header(src):
+        logger.debug("not a PDF; skipping extraction")
+        return ""
+
+    buf = io.StringIO()
+
+    # PyMuPDF is much faster; only fall back to pdfplumber if it yields nothing
+    try:
+        _fitz_extract(src, buf, max_pages)
+        if not buf.tell():
+            _pdfplumber_extract(src, buf, max_pages)
     except Exception as e:
-        print(f"extract_text top-level error: {e}", file=sys.stderr)
+        logger.warning("extract_text error: %s", e)
 
-    result = "\n".join(text_parts)
-    print(f"DEBUG: extracted text length = {len(result)}", file=sys.stderr)
+    result = buf.getvalue()
+    logger.debug("extracted text length = %d", len(result))
     return result
 
-def ask_bot(query: str, datasheet_text: str) -> str:
+def extract_text(uploaded_file, max_pages: int = 40, rewind: bool = False) -> str:
     """
-    Keyword-based generator. Handles 'uart', 'spi', 'gpio', 'i2c', 'timer', 'adc', 'pwm', 'blink', 'led'.
-    Returns generated C code (string).
+    Accepts a Streamlit UploadedFile (file-like) or a filesystem path (str/Path).
+    Returns extracted text. Always returns a string (possibly empty).
+    Only the first max_pages pages are read; registers and pinouts sit up front.
+    Uses PyMuPDF (fitz) first, falls back to pdfplumber. Catches errors and logs debug info.
+    In-memory uploads are handed over as a zero-copy view and paths are opened
+    by the backend directly, so the PDF is never duplicated into a bytes object.
+    Other file-likes are read to the end; pass rewind=True to seek back to 0 afterwards.
     """
-    if query is None:
-        query = ""
-    q = query.lower()
-
-    header_lines = [
-        "/*",
-        " * Auto-generated Embedded C Code (MISRA-C 2012 baseline)",
-        f" * Query: {query}",
-        " *",
-        " * MISRA Rules Applied:"
-    ]
-    header_lines += [f" *  - {r}" for r in MISRA_RULES]
-    header_lines.append(" */\n")
-    header = "\n".join(header_lines)
-
-    # LED blink handler (covers "blinking LED" queries)
-    if ("blink" in q) or ("led" in q):
-        code = r'''
+    try:
+        if hasattr(uploaded_file, "getbuffer"):
+            # io.BytesIO / Streamlit UploadedFile
+            return _extract_source(uploaded_file.getbuffer(), max_pages)
+        if hasattr(uploaded_file, "read"):
+            b = uploaded_file.read()
+            # reset pointer only if the caller will read the stream again
+            if rewind:
+                try:
+                    uploaded_file.seek(0)
+                except Exception:
+                    pass
+            # only str arguments are paths; a text-mode stream's contents are not
+            if not isinstance(b, (bytes, bytearray, memoryview)):
+                logger.warning("extract_text: stream returned %s, expected bytes", type(b).__name__)
+                return ""
+            return _extract_source(b, max_pages)
+        if isinstance(uploaded_file, (str, os.PathLike)):
+            # path: handed to the backends as-is, MuPDF opens/maps it itself
+            return _extract_source(os.fsdecode(uploaded_file), max_pages)
+        logger.warning("extract_text: unsupported input type %s", type(uploaded_file).__name__)
+        return ""
+    except Exception as e:
+        logger.warning("extract_text top-level error: %s", e)
+        return ""
+
+# C templates, one per peripheral keyword
+BLINK_CODE = r'''
 #include <stdint.h>
 #include <stdbool.h>
 
@@ -165,11 +262,8 @@ void LED_Blink(uint32_t times, uint32_t on_ms, uint32_t off_ms)
     }
 }
 '''
-        return header + code
 
-    # Existing peripheral templates
-    if "uart" in q:
-        code = r'''
+UART_CODE = r'''
 #include <stdint.h>
 #include <stdbool.h>
 
@@ -182,10 +276,8 @@ void UART_Init(void)
     *UART_CR  = (uint32_t)((1U << 0) | (1U << 2) | (1U << 3));
 }
 '''
-        return header + code
 
-    if "spi" in q:
-        code = r'''
+SPI_CODE = r'''
 #include <stdint.h>
 #include <stdbool.h>
 
@@ -196,10 +288,8 @@ void SPI_Init(void)
     *SPI_CR1 |= (uint32_t)(1U << 6);
 }
 '''
-        return header + code
 
-    if "gpio" in q:
-        code = r'''
+GPIO_CODE = r'''
 #include <stdint.h>
 #include <stdbool.h>
 
@@ -210,10 +300,8 @@ void GPIO_Init(void)
     *GPIO_MODER |= (uint32_t)(0x1U << (0U * 2U));
 }
 '''
-        return header + code
 
-    if "i2c" in q:
-        code = r'''
+I2C_CODE = r'''
 #include <stdint.h>
 #include <stdbool.h>
 
@@ -226,10 +314,8 @@ void I2C_Init(void)
     *I2C_CR1 |= (uint32_t)(1U << 0);
 }
 '''
-        return header + code
 
-    if "timer" in q:
-        code = r'''
+TIMER_CODE = r'''
 #include <stdint.h>
 #include <stdbool.h>
 
@@ -244,10 +330,8 @@ void Timer_Init(void)
     *TIM_CR1 |= (uint32_t)(1U << 0);
 }
 '''
-        return header + code
 
-    if "adc" in q:
-        code = r'''
+ADC_CODE = r'''
 #include <stdint.h>
 #include <stdbool.h>
 
@@ -260,10 +344,8 @@ void ADC_Init(void)
     *ADC_CR |= (uint32_t)(1U << 0);
 }
 '''
-        return header + code
 
-    if "pwm" in q:
-        code = r'''
+PWM_CODE = r'''
 #include <stdint.h>
 #include <stdbool.h>
 
@@ -280,14 +362,121 @@ void PWM_Init(void)
     *TIM_CR1 |= (uint32_t)(1U << 0);
 }
 '''
-        return header + code
 
-    # default placeholder
-    placeholder = r'''
+_PLACEHOLDER = r'''
 /* Placeholder. No matching template found for query. */
 void Device_Init(void)
 {
     /* Implementation pending */
 }
 '''
-    return header + placeholder
+
+# Keywords in match priority order ("blink"/"led" first, as before)
+# Interned, and _match_key always hands back these exact objects, so the
+# template-table lookups hit dict's identity fast path
+_KEYS = tuple(sys.intern(k) for k in ("blink", "led", "uart", "spi", "gpio", "i2c", "timer", "adc", "pwm"))
+
+_TEMPLATES: dict[str, str] = {
+    "blink": BLINK_CODE,
+    "led": BLINK_CODE,
+    "uart": UART_CODE,
+    "spi": SPI_CODE,
+    "gpio": GPIO_CODE,
+    "i2c": I2C_CODE,
+    "timer": TIMER_CODE,
+    "adc": ADC_CODE,
+    "pwm": PWM_CODE,
+}
+
+# One-pass multi-keyword scan. Preferred: a compiled Hyperscan database
+# (SIMD DFA, scales to large keyword sets); else an Aho-Corasick automaton;
+# else plain substring tests. Pattern ids / values carry the _KEYS priority
+# so "led uart" still resolves to the LED template.
+try:
+    import hyperscan
+except Exception:
+    hyperscan = None
+
+try:
+    import ahocorasick
+except Exception:
+    ahocorasick = None
+
+_KEY_DB = None
+if hyperscan is not None:
+    try:
+        _KEY_DB = hyperscan.Database()
+        _KEY_DB.compile(
+            expressions=[k.encode() for k in _KEYS],
+            ids=list(range(len(_KEYS))),
+            flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH] * len(_KEYS),
+        )
+    except Exception as e:
+        logger.warning("hyperscan compile failed: %s", e)
+        _KEY_DB = None
+
+# Hyperscan scratch space can't be shared by concurrent scans, and Streamlit
+# runs each session on its own thread: keep one Scratch per thread
+_KEY_SCRATCH = threading.local()
+
+def _key_scratch():
+    scratch = getattr(_KEY_SCRATCH, "scratch", None)
+    if scratch is None:
+        scratch = _KEY_SCRATCH.scratch = hyperscan.Scratch(_KEY_DB)
+    return scratch
+
+if ahocorasick is not None:
+    _KEY_AUTOMATON = ahocorasick.Automaton()
+    for _prio, _k in enumerate(_KEYS):
+        _KEY_AUTOMATON.add_word(_k, (_prio, _k))
+    _KEY_AUTOMATON.make_automaton()
+else:
+    _KEY_AUTOMATON = None
+
+_KEYS_B = tuple(k.encode() for k in _KEYS)
+
+def _match_key(query: str):
+    """Return the highest-priority keyword found in query (case-insensitive), or None."""
+    if _KEY_DB is not None:
+        # caseless patterns: no lowering needed
+        ids = []
+        _KEY_DB.scan(
+            query.encode("utf-8", "ignore"),
+            match_event_handler=lambda id_, *_: ids.append(id_),
+            scratch=_key_scratch(),
+        )
+        return _KEYS[min(ids)] if ids else None
+    if _KEY_AUTOMATON is not None:
+        hits = [v for _, v in _KEY_AUTOMATON.iter(query.lower())]
+        return min(hits)[1] if hits else None
+    # keywords are ASCII, so an ASCII-only bytes lower() is enough
+    qb = query.encode("utf-8", "ignore").lower()
+    i = next((i for i, kb in enumerate(_KEYS_B) if kb in qb), None)
+    return _KEYS[i] if i is not None else None
+
+# Generated header, rendered once; only the {query} slot varies per call
+_HEADER_FMT = (
+    "/*\n * Auto-generated Embedded C Code (MISRA-C 2012 baseline)\n * Query: {query}\n *\n * MISRA Rules Applied:\n"
+    + "\n".join(f" *  - {r}" for r in MISRA_RULES)
+    + "\n */\n"
+)
+
+# Header + template pre-joined per keyword; ask_bot only fills in the query
+# (str.replace with count=1 only touches the header's slot). Frozen, and kept
+# as str: st.code renders str, so bytes would only add a decode per call.
+_TEMPLATES_WITH_HEADER = types.MappingProxyType(
+    {k: _HEADER_FMT + v for k, v in _TEMPLATES.items()}
+)
+_PLACEHOLDER_WITH_HEADER = _HEADER_FMT + _PLACEHOLDER
+
+def ask_bot(query: str, datasheet_text: str) -> str:
+    """
+    Keyword-based generator. Handles 'uart', 'spi', 'gpio', 'i2c', 'timer', 'adc', 'pwm', 'blink', 'led'.
+    Returns generated C code (string).
+    """
+    if query is None:
+        query = ""
+    k = _match_key(query)
+    # default placeholder when no keyword matches
+    code = _TEMPLATES_WITH_HEADER[k] if k is not None else _PLACEHOLDER_WITH_HEADER
+    return code.replace("{query}", query, 1)
@@ -0,0 +1,44 @@
+import io
+import threading
+import unittest
+
+import chatbot_engine
+
+
+class AskBotThreadingTest(unittest.TestCase):
+    # Streamlit runs each session's script on its own thread; a shared
+    # Hyperscan scratch used to raise ScratchInUseError under concurrency.
+    def test_concurrent_ask_bot(self):
+        query = "please generate a pwm " + "x" * 200
+        expected = chatbot_engine.ask_bot(query, "")
+        errors = []
+
+        def run():
+            for _ in range(2000):
+                try:
+                    if chatbot_engine.ask_bot(query, "") != expected:
+                        errors.append("mismatched output")
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertIn("PWM_Init", expected)
+
+
+class ExtractTextInputTest(unittest.TestCase):
+    # A text-mode stream's contents must not be treated as a filesystem path
+    def test_text_stream_is_not_a_path(self):
+        with self.assertLogs("chatbot_engine", level="WARNING") as logs:
+            result = chatbot_engine.extract_text(io.StringIO("%PDF-1.4 some text"))
+        self.assertEqual(result, "")
+        self.assertNotIn("some text", "\n".join(logs.output))
+
+
+if __name__ == "__main__":
+    unittest.main()